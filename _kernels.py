@@ -0,0 +1,208 @@
+"""
+Pixel kernels and image helpers shared by the rad-pinker scripts.
+SciPy does the labeling and flood fills when it's installed; otherwise the
+array flood fills below do, compiled with Numba if it's available.
+"""
+
+import contextlib
+import functools
+import io
+import numpy as np
+from PIL import Image
+
+try:
+    from scipy import ndimage
+except ImportError:  # Use the array flood fills below instead
+    ndimage = None
+    try:
+        from numba import njit
+    except ImportError:  # Run them as plain Python
+        def njit(**options):
+            return lambda func: func
+
+
+if ndimage is None:
+    @njit(cache=True)  # Compiled once, then loaded from __pycache__
+    def label_clusters(mask):
+        """
+        Label 4-connected clusters of a boolean mask with an array-based flood fill.
+        Returns (labels, sizes) like ndimage.label + np.bincount.
+        """
+        h, w = mask.shape
+        flat = mask.ravel()
+        labels = np.zeros(h * w, dtype=np.int32)
+        sizes = np.zeros(h * w + 1, dtype=np.int64)
+        stack = np.empty(h * w, dtype=np.int32)
+        n = 0
+
+        for start in range(h * w):
+            if not flat[start] or labels[start] != 0:
+                continue
+
+            # Flood fill the cluster, labeling pixels as they're pushed
+            n += 1
+            labels[start] = n
+            stack[0] = start
+            sp = 1
+            while sp > 0:
+                sp -= 1
+                p = stack[sp]
+                sizes[n] += 1
+                y, x = p // w, p % w
+                if x + 1 < w and flat[p + 1] and labels[p + 1] == 0:
+                    labels[p + 1] = n
+                    stack[sp] = p + 1
+                    sp += 1
+                if x > 0 and flat[p - 1] and labels[p - 1] == 0:
+                    labels[p - 1] = n
+                    stack[sp] = p - 1
+                    sp += 1
+                if y + 1 < h and flat[p + w] and labels[p + w] == 0:
+                    labels[p + w] = n
+                    stack[sp] = p + w
+                    sp += 1
+                if y > 0 and flat[p - w] and labels[p - w] == 0:
+                    labels[p - w] = n
+                    stack[sp] = p - w
+                    sp += 1
+
+        return labels.reshape(h, w), sizes[:n + 1]
+
+    @njit(cache=True)
+    def flood_from_seeds(mask, seeds):
+        """
+        4-connected flood fill through a boolean mask from the seed pixels
+        (flat indices), with an array stack. Returns the filled pixels as a mask.
+        """
+        h, w = mask.shape
+        flat = mask.ravel()
+        filled = np.zeros(h * w, dtype=np.bool_)
+        stack = np.empty(h * w, dtype=np.int32)
+        sp = 0
+
+        # Pixels are marked as they're pushed, so each is pushed at most once
+        for p in seeds:
+            if flat[p] and not filled[p]:
+                filled[p] = True
+                stack[sp] = p
+                sp += 1
+
+        while sp > 0:
+            sp -= 1
+            p = stack[sp]
+            y, x = p // w, p % w
+            if x + 1 < w and flat[p + 1] and not filled[p + 1]:
+                filled[p + 1] = True
+                stack[sp] = p + 1
+                sp += 1
+            if x > 0 and flat[p - 1] and not filled[p - 1]:
+                filled[p - 1] = True
+                stack[sp] = p - 1
+                sp += 1
+            if y + 1 < h and flat[p + w] and not filled[p + w]:
+                filled[p + w] = True
+                stack[sp] = p + w
+                sp += 1
+            if y > 0 and flat[p - w] and not filled[p - w]:
+                filled[p - w] = True
+                stack[sp] = p - w
+                sp += 1
+
+        return filled.reshape(h, w)
+
+
+def find_small_clusters(mask, max_cluster_size):
+    """Mask of pixels in 4-connected clusters of at most max_cluster_size pixels."""
+    if ndimage is not None:
+        labels, _ = ndimage.label(mask)
+        sizes = np.bincount(labels.ravel())
+    else:
+        labels, sizes = label_clusters(np.ascontiguousarray(mask))
+    small = sizes <= max_cluster_size
+    small[0] = False  # Label 0 is everything outside the mask
+    return small[labels]
+
+
+def flood_from_edges(mask):
+    """
+    Pixels of a boolean mask 4-connected to the image edges.
+    Same result as a flood fill seeded from every edge pixel in the mask.
+    """
+    if ndimage is not None:
+        # The fill reaches exactly the regions that touch an edge, so label
+        # the regions and keep those found on the border
+        labels, count = ndimage.label(mask)
+        touches_edge = np.zeros(count + 1, dtype=bool)
+        touches_edge[np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]])] = True
+        touches_edge[0] = False  # Label 0 is everything outside the mask
+        return touches_edge[labels]
+
+    h, w = mask.shape
+    index = np.arange(h * w, dtype=np.int32).reshape(h, w)
+    seeds = np.concatenate([index[0], index[-1], index[:, 0], index[:, -1]])
+    # One fill over all four edges, on purpose: this path only runs without
+    # SciPy, and batch runs already keep every core busy with one process each
+    return flood_from_seeds(np.ascontiguousarray(mask), seeds)
+
+
+def grow_mask(mask, diagonals=False):
+    """The mask plus every pixel 4-adjacent to it (8-adjacent with diagonals)."""
+    if ndimage is not None:
+        structure = np.ones((3, 3), dtype=bool) if diagonals else None
+        return ndimage.binary_dilation(mask, structure=structure)
+
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    if diagonals:
+        # A 3x3 square is separable: grow the row-grown mask along the columns
+        mask = grown.copy()
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    return grown
+
+
+def most_common_color(rgb):
+    """
+    Most common color in an (N, 3) uint8 array, preferring the first seen on ties.
+    Packing RGB into one uint32 lets np.unique sort plain integers instead of rows.
+    """
+    packed = (rgb[:, 0].astype(np.uint32) << 16
+              | rgb[:, 1].astype(np.uint32) << 8
+              | rgb[:, 2])
+    colors, first_seen, counts = np.unique(packed, return_index=True, return_counts=True)
+    most_common = np.flatnonzero(counts == counts.max())
+    color = int(colors[most_common[first_seen[most_common].argmin()]])
+    return ((color >> 16) & 255, (color >> 8) & 255, color & 255)
+
+
+def open_rgba(path):
+    """Open an image as RGBA, skipping the conversion copy if it already is."""
+    img = Image.open(path)
+    img.load()
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+
+@functools.lru_cache(maxsize=8)
+def decode_background(background_path):
+    """
+    Decode a background image once per process.
+    Every caller shares the cached image, so the scripts only resize,
+    composite or copy from it and never draw on it.
+    """
+    return open_rgba(background_path)
+
+
+def run_captured(func, *args, **kwargs):
+    """
+    Call func, capturing what it prints, for process pool workers whose
+    lines the parent prints together per file instead of interleaved.
+    Returns (output, error message or None).
+    """
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            func(*args, **kwargs)
+        return output.getvalue(), None
+    except Exception as e:
+        return output.getvalue(), str(e)
@@ -16,6 +16,11 @@ import numpy as np
 import sys
 from pathlib import Path
 
+try:
+    from numba import njit, prange
+except ImportError:  # Fall back to the NumPy passes in swap_background_teal
+    njit = None
+
 
 def create_tiled_background(source_img_path, target_size, tile_size=40):
     """
@@ -26,19 +31,16 @@ def create_tiled_background(source_img_path, target_size, tile_size=40):
     source_arr = np.array(source)
 
     # Extract tile from top-left corner (away from any central design)
-    tile = source_arr[:tile_size, :tile_size]
+    tile = np.atleast_3d(source_arr[:tile_size, :tile_size])
+    if tile.shape[2] == 1:
+        tile = np.repeat(tile, 3, axis=2)  # Grayscale source
 
+    # Repeat the tile enough times to cover the target, then crop
     h, w = target_size
-    channels = tile.shape[2] if len(tile.shape) > 2 else 3
-    tiled_bg = np.zeros((h, w, channels), dtype=np.uint8)
-
-    for y in range(0, h, tile_size):
-        for x in range(0, w, tile_size):
-            y_end = min(y + tile_size, h)
-            x_end = min(x + tile_size, w)
-            tile_h = y_end - y
-            tile_w = x_end - x
-            tiled_bg[y:y_end, x:x_end] = tile[:tile_h, :tile_w]
+    tile_h, tile_w = tile.shape[:2]
+    reps_y = (h + tile_h - 1) // tile_h
+    reps_x = (w + tile_w - 1) // tile_w
+    tiled_bg = np.tile(tile, (reps_y, reps_x, 1))[:h, :w].astype(np.uint8, copy=False)
 
     return tiled_bg
 
@@ -61,16 +63,6 @@ def detect_background_color(img_arr, sample_size=20):
     return tuple(bg_color)
 
 
-def color_distance(c1, c2):
-    """Euclidean distance between two RGB colors."""
-    return np.sqrt(sum((a - b) ** 2 for a, b in zip(c1, c2)))
-
-
-def is_background_pixel(pixel, bg_color, tolerance=45):
-    """Check if pixel matches background color within tolerance."""
-    return color_distance(pixel[:3], bg_color) < tolerance
-
-
 def swap_background_generic(character_img_path, background_source_path, output_path,
                            tile_size=40, tolerance=45, use_tiling=True):
     """
@@ -94,7 +86,8 @@ def swap_background_generic(character_img_path, background_source_path, output_p
         new_bg = create_tiled_background(background_source_path, (h, w), tile_size)
     else:
         bg_img = Image.open(background_source_path).convert('RGB')
-        bg_img = bg_img.resize((w, h), Image.Resampling.LANCZOS)
+        if bg_img.size != (w, h):
+            bg_img = bg_img.resize((w, h), Image.Resampling.LANCZOS)
         new_bg = np.array(bg_img)
 
     # Detect background color
@@ -110,14 +103,19 @@ def swap_background_generic(character_img_path, background_source_path, output_p
         (tolerance + 30, "remaining artifacts"),
     ]
 
+    # Squared distance to the background color for every pixel, computed once
+    # against the original image (int32 so the squared channel differences
+    # can't overflow). A replaced pixel only ever becomes new_bg, so each pass
+    # just widens the mask of replaced pixels.
+    diff = character_arr.astype(np.int32) - np.asarray(bg_color, dtype=np.int32)
+    dist2 = np.einsum('hwc,hwc->hw', diff, diff)
+
+    replaced_mask = np.zeros((h, w), dtype=bool)
     for pass_tolerance, desc in passes:
-        replaced = 0
-        for y in range(h):
-            for x in range(w):
-                pixel = result[y, x]
-                if is_background_pixel(pixel, bg_color, pass_tolerance):
-                    result[y, x] = new_bg[y, x]
-                    replaced += 1
+        mask = (dist2 < pass_tolerance * pass_tolerance) & ~replaced_mask
+        result[mask] = new_bg[mask]
+        replaced_mask |= mask
+        replaced = int(np.sum(mask))
         print(f"Pass ({desc}): replaced {replaced} pixels")
 
     # Save result
@@ -128,6 +126,37 @@ def swap_background_generic(character_img_path, background_source_path, output_p
     return result
 
 
+if njit is not None:
+    # cache=True stores the compiled kernel next to this script, so only the
+    # first run pays the JIT compile time
+    @njit(parallel=True, cache=True)
+    def teal_cleanup_fused(result, tiled_bg):
+        """
+        All five teal cleanup passes in a single scan over the image.
+        A replaced pixel only ever becomes tiled_bg, so applying the
+        passes' conditions together matches running them one by one.
+        """
+        h, w = result.shape[:2]
+        for y in prange(h):
+            for x in range(w):
+                r = np.int32(result[y, x, 0])
+                g = np.int32(result[y, x, 1])
+                b = np.int32(result[y, x, 2])
+                if (
+                    # Pass 1: pure/bright background
+                    (g > 200 and b > 150 and r < 80)
+                    # Pass 2: medium-bright teal artifacts
+                    or (g > 140 and b > 100 and r < 100 and g > r and g > b)
+                    # Pass 3: darker teal artifacts
+                    or (g > 120 and r < 100 and g > r and g > b - 20)
+                    # Pass 4: remaining artifacts
+                    or (g > 100 and r < 80 and g > r + 20)
+                    # Pass 5: final cleanup (brightness >= 30 keeps very dark outlines)
+                    or (g > r + 10 and g > 40 and r + g + b >= 90)
+                ):
+                    result[y, x, :] = tiled_bg[y, x, :]
+
+
 def swap_background_teal(character_img_path, background_source_path, output_path, tile_size=40):
     """
     Original teal-specific background swap with multi-pass cleanup.
@@ -145,48 +174,52 @@ def swap_background_teal(character_img_path, background_source_path, output_path
     bg_color = np.median(corner_sample.reshape(-1, 3), axis=0)
     print(f"Detected background color: RGB{tuple(bg_color.astype(int))}")
 
+    # The kernel indexes both arrays pixel by pixel, so an RGB character on an
+    # RGBA pattern (or the reverse) must be caught here rather than inside it
+    if character_arr.shape != tiled_bg.shape:
+        raise ValueError(
+            f"Character image {character_img_path} has shape {character_arr.shape} "
+            f"({character_img.mode}) but the tiled background from {background_source_path} "
+            f"has shape {tiled_bg.shape}; both need the same size and channel count")
+
     result = character_arr.copy()
 
-    # --- PASS 1: Replace pure/bright background ---
-    for y in range(h):
-        for x in range(w):
-            r, g, b = int(result[y, x, 0]), int(result[y, x, 1]), int(result[y, x, 2])
-            if g > 200 and b > 150 and r < 80:
-                result[y, x] = tiled_bg[y, x]
-    print("Pass 1: Replaced pure background pixels")
-
-    # --- PASS 2: Clean up medium-bright teal artifacts ---
-    for y in range(h):
-        for x in range(w):
-            r, g, b = int(result[y, x, 0]), int(result[y, x, 1]), int(result[y, x, 2])
-            if g > 140 and b > 100 and r < 100 and g > r and g > b:
-                result[y, x] = tiled_bg[y, x]
-    print("Pass 2: Cleaned medium-bright edge artifacts")
-
-    # --- PASS 3: Clean up darker teal artifacts ---
-    for y in range(h):
-        for x in range(w):
-            r, g, b = int(result[y, x, 0]), int(result[y, x, 1]), int(result[y, x, 2])
-            if g > 120 and r < 100 and g > r and g > b - 20:
-                result[y, x] = tiled_bg[y, x]
-    print("Pass 3: Cleaned darker teal artifacts")
-
-    # --- PASS 4: Clean up remaining artifacts ---
-    for y in range(h):
-        for x in range(w):
-            r, g, b = int(result[y, x, 0]), int(result[y, x, 1]), int(result[y, x, 2])
-            if g > 100 and r < 80 and g > r + 20:
-                result[y, x] = tiled_bg[y, x]
-    print("Pass 4: Cleaned remaining artifacts")
-
-    # --- PASS 5: Final cleanup ---
-    for y in range(h):
-        for x in range(w):
-            r, g, b = int(result[y, x, 0]), int(result[y, x, 1]), int(result[y, x, 2])
-            brightness = (r + g + b) / 3
-            if g > r + 10 and g > 40 and brightness >= 30:
-                result[y, x] = tiled_bg[y, x]
-    print("Pass 5: Final cleanup (preserving very dark outlines)")
+    if njit is not None:
+        teal_cleanup_fused(result, tiled_bg)
+        print("Passes 1-5: Replaced background and cleaned teal artifacts in one scan")
+    else:
+        # Signed copies of the channel planes so expressions like g > r + 20
+        # can't wrap around in uint8. Taken once: a pass only ever writes
+        # tiled_bg, which later passes would write again anyway.
+        r = character_arr[..., 0].astype(np.int16)
+        g = character_arr[..., 1].astype(np.int16)
+        b = character_arr[..., 2].astype(np.int16)
+
+        # --- PASS 1: Replace pure/bright background ---
+        mask = (g > 200) & (b > 150) & (r < 80)
+        result[mask] = tiled_bg[mask]
+        print("Pass 1: Replaced pure background pixels")
+
+        # --- PASS 2: Clean up medium-bright teal artifacts ---
+        mask = (g > 140) & (b > 100) & (r < 100) & (g > r) & (g > b)
+        result[mask] = tiled_bg[mask]
+        print("Pass 2: Cleaned medium-bright edge artifacts")
+
+        # --- PASS 3: Clean up darker teal artifacts ---
+        mask = (g > 120) & (r < 100) & (g > r) & (g > b - 20)
+        result[mask] = tiled_bg[mask]
+        print("Pass 3: Cleaned darker teal artifacts")
+
+        # --- PASS 4: Clean up remaining artifacts ---
+        mask = (g > 100) & (r < 80) & (g > r + 20)
+        result[mask] = tiled_bg[mask]
+        print("Pass 4: Cleaned remaining artifacts")
+
+        # --- PASS 5: Final cleanup ---
+        brightness = (r + g + b) // 3
+        mask = (g > r + 10) & (g > 40) & (brightness >= 30)
+        result[mask] = tiled_bg[mask]
+        print("Pass 5: Final cleanup (preserving very dark outlines)")
 
     # Save result
     result_img = Image.fromarray(result)
@@ -5,10 +5,11 @@ Removes small isolated clusters of specified colors.
 """
 
 import sys
-import math
+import numpy as np
 from PIL import Image
 from pathlib import Path
-from collections import deque
+
+from _kernels import find_small_clusters
 
 # Colors to clean up
 COLORS_TO_REMOVE = [
@@ -20,73 +21,35 @@ COLORS_TO_REMOVE = [
 
 TOLERANCE = 45
 
-def color_distance(c1, c2):
-    return math.sqrt(sum((a - b) ** 2 for a, b in zip(c1[:3], c2[:3])))
-
-def matches_any_target(pixel):
-    """Check if pixel matches any of the target colors to remove."""
-    if len(pixel) == 4 and pixel[3] == 0:
-        return False
-    for target, _ in COLORS_TO_REMOVE:
-        if color_distance(pixel[:3], target) < TOLERANCE:
-            return True
-    return False
-
-def find_colored_clusters(img):
-    """Find all clusters of target-colored pixels."""
-    pixels = img.load()
-    width, height = img.size
-    visited = set()
-    clusters = []
-
-    for y in range(height):
-        for x in range(width):
-            if (x, y) in visited:
-                continue
-            if not matches_any_target(pixels[x, y]):
-                continue
-
-            # BFS to find cluster
-            cluster = set()
-            queue = deque([(x, y)])
-            while queue:
-                cx, cy = queue.popleft()
-                if (cx, cy) in visited:
-                    continue
-                if cx < 0 or cx >= width or cy < 0 or cy >= height:
-                    continue
-                if not matches_any_target(pixels[cx, cy]):
-                    continue
-
-                visited.add((cx, cy))
-                cluster.add((cx, cy))
-                queue.append((cx + 1, cy))
-                queue.append((cx - 1, cy))
-                queue.append((cx, cy + 1))
-                queue.append((cx, cy - 1))
-
-            if cluster:
-                clusters.append(cluster)
-
-    return clusters
+TARGETS = np.array([target for target, _ in COLORS_TO_REMOVE], dtype=np.float32)
+
+def target_color_mask(arr):
+    """Boolean mask of non-transparent pixels matching any of the target colors."""
+    # Squared distances to all targets at once as |p|^2 - 2*p.t + |t|^2, so
+    # the whole test is one (H, W, 3) @ (3, K) product rather than K passes.
+    # Every term is an integer below 2**24, so float32 stays exact.
+    rgb = arr[..., :3].astype(np.float32)
+    dist2 = (np.einsum('hwc,hwc->hw', rgb, rgb)[..., None]
+             - 2 * (rgb @ TARGETS.T)
+             + np.einsum('kc,kc->k', TARGETS, TARGETS))
+    mask = (dist2 < TOLERANCE * TOLERANCE).any(axis=-1)
+    mask &= arr[..., 3] != 0
+    return mask
 
 def cleanup_image(input_path, bg_path, max_cluster_size=30):
     """Remove small colored clusters from image."""
     img = Image.open(input_path).convert('RGBA')
-    pixels = img.load()
-
-    clusters = find_colored_clusters(img)
-    removed = 0
+    arr = np.array(img)
 
-    for cluster in clusters:
-        if len(cluster) <= max_cluster_size:
-            for (x, y) in cluster:
-                pixels[x, y] = (0, 0, 0, 0)
-            removed += len(cluster)
+    small = find_small_clusters(target_color_mask(arr), max_cluster_size)
+    arr[small] = (0, 0, 0, 0)
+    removed = int(small.sum())
+    img = Image.fromarray(arr)
 
     # Composite with background
     background = Image.open(bg_path).convert('RGBA')
-    background = background.resize(img.size, Image.Resampling.NEAREST)
+    if background.size != img.size:
+        background = background.resize(img.size, Image.Resampling.NEAREST)
     final = Image.alpha_composite(background, img)
     final.save(input_path, 'PNG')
 
@@ -4,17 +4,98 @@ Rad Pinker - Apply pink background to character images
 Usage: python rad_pinker.py character1.png character2.png ...
 """
 
-from PIL import Image
 import os
+import queue
 import sys
+import threading
+
+from _kernels import open_rgba, decode_background
+
+
+class PrefetchReader(threading.Thread):
+    """
+    Decodes input images on a background thread so the next file is read
+    while the current one is composited (Pillow releases the GIL while decoding).
+    Iterate it to get (path, image, error) tuples in input order; image is
+    None if the file is missing or failed to decode (error is set for the latter).
+    """
+
+    def __init__(self, paths, maxsize=4):
+        super().__init__(daemon=True)
+        self.paths = paths
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def run(self):
+        for path in self.paths:
+            if not os.path.exists(path):
+                item = (path, None, None)
+            else:
+                try:
+                    item = (path, open_rgba(path), None)
+                except Exception as e:
+                    item = (path, None, e)
+            self.queue.put(item)
+        self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            yield item
+
+
+class ImageWriter(threading.Thread):
+    """
+    Saves images on a background thread so encoding one PNG overlaps with
+    compositing the next (Pillow releases the GIL while encoding).
+    Queue saves with put(image, path, source) and other messages with
+    report(message); this thread prints everything, so the log stays in
+    input order. close() waits for the queue to finish.
+    """
+
+    def __init__(self, maxsize=4):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, image, path, source):
+        self.queue.put((image, path, source))
+
+    def report(self, message):
+        self.queue.put((None, message, None))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            image, path, source = item
+            if image is None:
+                print(path)  # A queued message
+                continue
+            try:
+                image.save(path, "PNG")
+                print(f"Saved: {path}")
+            except Exception as e:
+                print(f"Error processing {source}: {e}")
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
 
-def apply_pink_background(character_path, background_path, output_dir):
-    """Places a character image on top of a pink background."""
-    bg = Image.open(background_path).convert("RGBA")
-    character = Image.open(character_path).convert("RGBA")
+def apply_pink_background(character_path, background_path, output_dir, character=None, writer=None):
+    """
+    Places a character image on top of a pink background.
+    Pass character if the image at character_path is already decoded, and
+    writer (an ImageWriter) to save in the background instead of here.
+    """
+    bg = decode_background(background_path)
+    if character is None:
+        character = open_rgba(character_path)
 
-    # Resize background to match character size
-    bg_resized = bg.resize(character.size)
+    # Resize background to match character size (copy so the cached one stays clean)
+    bg_resized = bg.copy() if bg.size == character.size else bg.resize(character.size)
 
     # Paste character on top using its alpha as mask
     bg_resized.paste(character, (0, 0), character)
@@ -23,8 +104,11 @@ def apply_pink_background(character_path, background_path, output_dir):
     name = os.path.splitext(os.path.basename(character_path))[0]
     output_path = os.path.join(output_dir, f"{name}_pink.png")
 
-    bg_resized.save(output_path, "PNG")
-    print(f"Saved: {output_path}")
+    if writer is not None:
+        writer.put(bg_resized, output_path, character_path)
+    else:
+        bg_resized.save(output_path, "PNG")
+        print(f"Saved: {output_path}")
     return output_path
 
 
@@ -54,15 +138,22 @@ def main():
     output_dir = os.path.join(os.getcwd(), "pink_output")
     os.makedirs(output_dir, exist_ok=True)
 
-    # Process each file
-    for f in files:
-        if os.path.exists(f):
+    # Process each file, decoding the next ones and saving finished ones in the background
+    reader = PrefetchReader(files)
+    writer = ImageWriter()
+    reader.start()
+    writer.start()
+    for f, character, error in reader:
+        if error is not None:
+            writer.report(f"Error processing {f}: {error}")
+        elif character is None:
+            writer.report(f"File not found: {f}")
+        else:
             try:
-                apply_pink_background(f, bg_path, output_dir)
+                apply_pink_background(f, bg_path, output_dir, character, writer)
             except Exception as e:
-                print(f"Error processing {f}: {e}")
-        else:
-            print(f"File not found: {f}")
+                writer.report(f"Error processing {f}: {e}")
+    writer.close()
 
     print(f"\nDone! Check the 'pink_output' folder")
 
@@ -7,216 +7,186 @@ Uses flood fill from edges + fringe removal for clean edges.
 """
 
 import sys
-import math
-import colorsys
+import functools
+import numpy as np
 from PIL import Image
 from pathlib import Path
-from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from _kernels import (flood_from_edges, grow_mask, most_common_color, open_rgba,
+                      decode_background, run_captured)
 
 TOLERANCE = 45  # Color distance tolerance for flood fill
 FRINGE_TOLERANCE = 55  # Moderate tolerance for fringe cleanup
 HUE_TOLERANCE = 0.12  # Hue similarity threshold (0-1 scale)
+TILE_MAX_PIXELS = 64 * 64  # Smaller backgrounds are repeating patterns: tile instead of stretching
+FLOOD_CACHE_SIZE = 8  # Flood fill results each batch worker keeps for reuse
+
+batch_flood_cache = None  # Set up per worker by init_batch_worker; single runs don't cache
 
-def color_distance(c1, c2):
-    """Calculate Euclidean distance between two RGB colors."""
-    return math.sqrt(sum((a - b) ** 2 for a, b in zip(c1[:3], c2[:3])))
+def rgb_to_hls_np(rgb):
+    """
+    Vectorized colorsys.rgb_to_hls for an (..., 3) array of 0-255 RGB values.
+    Returns (h, l, s) arrays, all on a 0-1 scale.
+    """
+    norm = np.asarray(rgb)[..., :3] / 255.0
+    r, g, b = norm[..., 0], norm[..., 1], norm[..., 2]
+    maxc = norm.max(axis=-1)
+    minc = norm.min(axis=-1)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    l = sumc / 2.0
+    gray = rangec == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(l <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc))
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(gray, 0.0, (h / 6.0) % 1.0)
+    s = np.where(gray, 0.0, s)
+    return h, l, s
 
 def rgb_to_hue(rgb):
     """Convert RGB to hue (0-1 scale). Returns None for grayscale."""
-    r, g, b = rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0
-    h, l, s = colorsys.rgb_to_hls(r, g, b)
+    h, l, s = rgb_to_hls_np(rgb)
     if s < 0.1:  # Too desaturated to have meaningful hue
         return None
-    return h
-
-def hue_distance(h1, h2):
-    """Calculate circular distance between two hues (0-1 scale)."""
-    if h1 is None or h2 is None:
-        return 1.0  # Max distance if either is grayscale
-    diff = abs(h1 - h2)
-    return min(diff, 1.0 - diff)
-
-def is_target_color(pixel, target, tolerance=TOLERANCE):
-    """Check if a pixel matches the target color within tolerance."""
-    if len(pixel) == 4 and pixel[3] == 0:  # Already transparent
-        return False
-    return color_distance(pixel[:3], target[:3]) < tolerance
-
-def is_fringe_pixel(pixel, bg_color, bg_hue):
+    return float(h)
+
+def edge_strips(img):
     """
-    Check if pixel is a fringe/edge pixel contaminated by background color.
-    Balanced approach - close color match OR (similar hue AND saturated).
+    The top, bottom, left and right 1-pixel edges of an RGBA image, as (N, 4) arrays.
+    Cropped out first: converting the whole image to an array would copy
+    every pixel to look at a few thousand of them.
     """
-    if len(pixel) == 4 and pixel[3] == 0:
-        return False
-
-    dist = color_distance(pixel[:3], bg_color[:3])
-
-    # Very close to bg color - definitely fringe
-    if dist < 40:
-        return True
-
-    # Moderately close + similar hue = likely fringe
-    if dist < FRINGE_TOLERANCE:
-        pixel_hue = rgb_to_hue(pixel[:3])
-        if pixel_hue is not None and bg_hue is not None:
-            if hue_distance(pixel_hue, bg_hue) < HUE_TOLERANCE:
-                # Check saturation - only remove if noticeably colored
-                r, g, b = pixel[0] / 255.0, pixel[1] / 255.0, pixel[2] / 255.0
-                _, l, s = colorsys.rgb_to_hls(r, g, b)
-                # Don't remove dark pixels (likely intentional dark outlines)
-                if s > 0.25 and l > 0.2:
-                    return True
-
-    return False
+    w, h = img.size
+    boxes = [(0, 0, w, 1), (0, h - 1, w, h), (0, 0, 1, h), (w - 1, 0, w, h)]
+    return [np.asarray(img.crop(box)).reshape(-1, 4) for box in boxes]
 
 def has_transparent_background(img):
     """
     Check if image already has a transparent background.
     Returns True if most edge pixels are transparent.
     """
-    pixels = img.load()
-    width, height = img.size
-    transparent_count = 0
-    total_edge = 0
-
-    # Check edge pixels for transparency
-    for x in range(width):
-        if pixels[x, 0][3] == 0:  # Top edge
-            transparent_count += 1
-        if pixels[x, height - 1][3] == 0:  # Bottom edge
-            transparent_count += 1
-        total_edge += 2
-    for y in range(height):
-        if pixels[0, y][3] == 0:  # Left edge
-            transparent_count += 1
-        if pixels[width - 1, y][3] == 0:  # Right edge
-            transparent_count += 1
-        total_edge += 2
+    edges = np.concatenate([strip[:, 3] for strip in edge_strips(img)])
 
     # If more than 50% of edges are transparent, it's already transparent
-    return transparent_count / total_edge > 0.5
+    return (edges == 0).mean() > 0.5
 
 def detect_background_color(img):
     """
     Detect background color by sampling edge pixels.
     Returns the most common non-transparent color found on edges.
     """
-    pixels = img.load()
-    width, height = img.size
-    edge_colors = []
-
-    # Sample all edge pixels (only opaque ones)
-    for x in range(width):
-        if pixels[x, 0][3] > 0:
-            edge_colors.append(pixels[x, 0][:3])
-        if pixels[x, height - 1][3] > 0:
-            edge_colors.append(pixels[x, height - 1][:3])
-    for y in range(height):
-        if pixels[0, y][3] > 0:
-            edge_colors.append(pixels[0, y][:3])
-        if pixels[width - 1, y][3] > 0:
-            edge_colors.append(pixels[width - 1, y][:3])
-
-    if not edge_colors:
+    top, bottom, left, right = edge_strips(img)
+
+    # Sample all edge pixels (in the old scan order, so ties resolve the same way)
+    edges = np.concatenate([
+        np.stack([top, bottom], axis=1).reshape(-1, 4),
+        np.stack([left, right], axis=1).reshape(-1, 4),
+    ])
+    edge_colors = edges[edges[:, 3] > 0, :3]  # Only opaque ones
+
+    if len(edge_colors) == 0:
         return None
 
-    # Find most common color
-    color_counts = Counter(edge_colors)
-    bg_color = color_counts.most_common(1)[0][0]
-    return bg_color
+    return most_common_color(edge_colors)
 
-def flood_fill_background(img, bg_color):
+def flood_fill_background(arr, bg_color, cache=None):
     """
-    Flood fill from edges to find background pixels.
-    Returns a set of (x, y) coordinates that are background.
+    Flood fill from edges of an (height, width, 4) RGBA array to find background pixels.
+    Returns a boolean (height, width) mask of background pixels.
+    cache: optional dict of recent fills, (shape, bg_color) -> (candidate, bg_mask),
+    reused when the candidate mask matches exactly.
     """
-    pixels = img.load()
-    width, height = img.size
-    visited = set()
-    background = set()
-    queue = deque()
-
-    # Start from all edge pixels that match background color
-    for x in range(width):
-        if is_target_color(pixels[x, 0], bg_color):
-            queue.append((x, 0))
-        if is_target_color(pixels[x, height - 1], bg_color):
-            queue.append((x, height - 1))
-    for y in range(height):
-        if is_target_color(pixels[0, y], bg_color):
-            queue.append((0, y))
-        if is_target_color(pixels[width - 1, y], bg_color):
-            queue.append((width - 1, y))
-
-    # Flood fill
-    while queue:
-        x, y = queue.popleft()
-        if (x, y) in visited:
-            continue
-        if x < 0 or x >= width or y < 0 or y >= height:
-            continue
-
-        pixel = pixels[x, y]
-        if not is_target_color(pixel, bg_color):
-            continue
-
-        visited.add((x, y))
-        background.add((x, y))
-
-        # Add neighbors (4-connected)
-        queue.append((x + 1, y))
-        queue.append((x - 1, y))
-        queue.append((x, y + 1))
-        queue.append((x, y - 1))
-
-    return background
-
-def remove_fringe(img, background_pixels, bg_color):
+    diff = arr[..., :3].astype(np.int32) - np.array(bg_color[:3], dtype=np.int32)
+    candidate = np.einsum('hwc,hwc->hw', diff, diff) < TOLERANCE * TOLERANCE
+    candidate &= arr[..., 3] != 0  # Already transparent
+
+    # The fill depends on nothing but the candidate mask, and batches often
+    # repeat it (same size, same bg, same framing), so reuse an exact match
+    key = (candidate.shape, tuple(bg_color[:3]))
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None and np.array_equal(cached[0], candidate):
+        return cached[1].copy()
+
+    bg_mask = flood_from_edges(candidate)  # Color tests are done above, so the fill only reads the mask
+
+    if cache is not None:
+        if key not in cache and len(cache) >= FLOOD_CACHE_SIZE:
+            del cache[next(iter(cache))]  # Drop the oldest entry
+        cache[key] = (candidate, bg_mask.copy())  # Private copy; the caller gets bg_mask
+    return bg_mask
+
+def remove_fringe(arr, bg_mask, bg_color):
     """
     Remove fringe pixels adjacent to background that have background color contamination.
-    Does multiple passes to clean up anti-aliased edges.
+    Balanced approach - close color match OR (similar hue AND saturated).
+    arr is the image's RGBA array; returns the background mask extended with the fringe pixels.
     """
-    pixels = img.load()
-    width, height = img.size
     bg_hue = rgb_to_hue(bg_color)
 
-    removed = set(background_pixels)
-
-    # Single pass for pixel art (hard edges, not anti-aliased)
-    for _ in range(1):
-        fringe = set()
-
-        # Find pixels adjacent to removed pixels
-        for (x, y) in removed:
-            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < width and 0 <= ny < height:
-                    if (nx, ny) not in removed:
-                        pixel = pixels[nx, ny]
-                        if is_fringe_pixel(pixel, bg_color, bg_hue):
-                            fringe.add((nx, ny))
+    # Single pass for pixel art (hard edges, not anti-aliased):
+    # candidates are the pixels 8-adjacent to the background. Only these
+    # can become fringe, so the color tests below run on them alone.
+    border = grow_mask(bg_mask, diagonals=True) & ~bg_mask
+    border &= arr[..., 3] != 0
+    ys, xs = np.nonzero(border)
+    rgb = arr[ys, xs, :3].astype(np.int32)
 
-        if not fringe:
-            break
+    diff = rgb - np.array(bg_color[:3], dtype=np.int32)
+    dist2 = np.einsum('nc,nc->n', diff, diff)
 
-        removed.update(fringe)
+    # Very close to bg color - definitely fringe
+    fringe = dist2 < 40 * 40
 
+    # Moderately close + similar hue = likely fringe
+    if bg_hue is not None:
+        h, l, s = rgb_to_hls_np(rgb)
+        hue_diff = np.abs(h - bg_hue)
+        hue_diff = np.minimum(hue_diff, 1.0 - hue_diff)
+        # Only remove noticeably colored pixels; keep dark ones (likely intentional dark outlines)
+        fringe |= ((dist2 < FRINGE_TOLERANCE * FRINGE_TOLERANCE) & (hue_diff < HUE_TOLERANCE)
+                   & (s > 0.25) & (l > 0.2))
+
+    removed = bg_mask.copy()
+    removed[ys[fringe], xs[fringe]] = True
     return removed
 
-def replace_background(input_path, background_path, output_path):
-    """Replace background with new background image."""
-    # Load images
-    img = Image.open(input_path).convert('RGBA')
-    background = Image.open(background_path).convert('RGBA')
+@functools.lru_cache(maxsize=8)
+def load_background(background_path, size):
+    """
+    Load the background resized to size, or tiled to size if it's a small pattern.
+    Cached so a batch resizes it only once per distinct input size (and
+    decodes it only once overall). The result is shared between calls, so
+    it's only ever composited from.
+    """
+    background = decode_background(background_path)
+    bw, bh = background.size
+    if bw * bh < TILE_MAX_PIXELS:
+        # Repeat the pattern at its own scale; a plain memory copy, no resampling
+        w, h = size
+        pattern = np.asarray(background)
+        tiled = np.tile(pattern, (-(-h // bh), -(-w // bw), 1))[:h, :w]
+        return Image.fromarray(np.ascontiguousarray(tiled))
+    if background.size != size:
+        background = background.resize(size, Image.Resampling.NEAREST)
+    return background
 
-    # Resize background to match input image size
-    background = background.resize(img.size, Image.Resampling.NEAREST)
+def replace_background(input_path, background_path, output_path, flood_cache=None):
+    """
+    Replace background with new background image.
+    flood_cache: optional dict for flood_fill_background to reuse fills across a batch.
+    """
+    # Load image; the background is only fetched once it's needed, after the
+    # cheap checks (decoded once per process and cached per size)
+    img = open_rgba(input_path)
 
     # Check if image already has transparent background
     if has_transparent_background(img):
         # Just composite - no color replacement needed
-        final = Image.alpha_composite(background, img)
+        final = Image.alpha_composite(load_background(background_path, img.size), img)
         final.save(output_path, 'PNG')
         print(f"✓ Saved: {output_path} (transparent bg - composited only)")
         return
@@ -225,31 +195,45 @@ def replace_background(input_path, background_path, output_path):
     bg_color = detect_background_color(img)
     if bg_color is None:
         # Fallback - just composite
-        final = Image.alpha_composite(background, img)
+        final = Image.alpha_composite(load_background(background_path, img.size), img)
         final.save(output_path, 'PNG')
         print(f"✓ Saved: {output_path} (no bg detected - composited only)")
         return
 
     # Find background pixels using flood fill
-    bg_pixels = flood_fill_background(img, bg_color)
+    # Every array step below reads this one copy of the pixels
+    arr = np.asarray(img)
+    bg_mask = flood_fill_background(arr, bg_color, flood_cache)
 
     # Remove fringe pixels (anti-aliased edges with background color bleed)
-    all_removed = remove_fringe(img, bg_pixels, bg_color)
-
-    # Get pixel data
-    pixels = img.load()
+    all_removed = remove_fringe(arr, bg_mask, bg_color)
 
-    # Replace background + fringe pixels with transparent
-    for (x, y) in all_removed:
-        pixels[x, y] = (0, 0, 0, 0)
+    # Background resized to match input image size
+    background = load_background(background_path, img.size)
 
-    # Composite: background + character
+    # Composite: background + character, then show the background through
+    # the removed pixels. Same result as making them transparent first, but
+    # without copying the image into an array and back.
     final = Image.alpha_composite(background, img)
+    final.paste(background, (0, 0), Image.fromarray(all_removed.view(np.uint8) * np.uint8(255)))
 
     # Save
     final.save(output_path, 'PNG')
-    fringe_count = len(all_removed) - len(bg_pixels)
-    print(f"✓ Saved: {output_path} (bg: rgb{bg_color}, removed {len(bg_pixels)} bg + {fringe_count} fringe pixels)")
+    bg_count = int(bg_mask.sum())
+    fringe_count = int(all_removed.sum()) - bg_count
+    print(f"✓ Saved: {output_path} (bg: rgb{bg_color}, removed {bg_count} bg + {fringe_count} fringe pixels)")
+
+def init_batch_worker():
+    """Give each batch_replace worker process its own flood fill cache."""
+    global batch_flood_cache
+    batch_flood_cache = {}
+
+def _process_one(task):
+    """Worker for batch_replace; returns (file name, output, error message or None)."""
+    img_file, background_path, output_file = task
+    output, error = run_captured(replace_background, img_file, background_path, output_file,
+                                 batch_flood_cache)
+    return Path(img_file).name, output, error
 
 def batch_replace(input_folder, background_path, output_folder):
     """Process all images in a folder."""
@@ -260,17 +244,27 @@ def batch_replace(input_folder, background_path, output_folder):
     image_extensions = {'.png', '.jpg', '.jpeg', '.webp'}
     bg_name = Path(background_path).name
 
-    processed = 0
+    tasks = []
     for img_file in sorted(input_path.iterdir()):
         if img_file.suffix.lower() in image_extensions:
             if img_file.name == bg_name:
                 continue
             output_file = output_path / f"{img_file.stem}_pink.png"
-            try:
-                replace_background(str(img_file), background_path, str(output_file))
+            tasks.append((str(img_file), background_path, str(output_file)))
+
+    # Images are independent, so process them in parallel, one worker per core.
+    # Tasks go out one at a time: each takes far longer than its IPC round trip,
+    # and handing them out in blocks would leave workers idle on small folders.
+    processed = 0
+    with ProcessPoolExecutor(initializer=init_batch_worker) as executor:
+        for name, output, error in executor.map(_process_one, tasks):
+            if error is None:
+                print(f"{name}:")  # Header for the worker's lines; the error line names the file itself
+                print(output, end='')
                 processed += 1
-            except Exception as e:
-                print(f"✗ Error processing {img_file.name}: {e}")
+            else:
+                print(output, end='')
+                print(f"✗ Error processing {name}: {error}")
 
     print(f"\nProcessed {processed} images → {output_folder}")
 
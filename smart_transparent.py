@@ -12,33 +12,32 @@ on yellow background), those regions may need manual restoration.
 """
 
 from PIL import Image
-import math
-from collections import deque
+import numpy as np
 import sys
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
+from _kernels import flood_from_edges, grow_mask, most_common_color, open_rgba, decode_background, run_captured
 
-def color_dist(c1, c2):
-    """Euclidean distance between two RGB colors."""
-    return math.sqrt(sum((a - b) ** 2 for a, b in zip(c1[:3], c2[:3])))
 
-
-def is_dark(pixel, threshold=50):
-    """Check if pixel is dark (part of outline)."""
-    return pixel[0] < threshold and pixel[1] < threshold and pixel[2] < threshold
+def corner_samples(arr, sample_size=20):
+    """
+    RGB values of the sample_size x sample_size corner blocks, as an (N, 3) array.
+    Ordered as the old per-pixel corner scan (x, then y, then the four corners).
+    """
+    flip_x = arr[:, ::-1]
+    flip_y = arr[::-1]
+    flip_xy = arr[::-1, ::-1]
+    blocks = [a[:sample_size, :sample_size, :3].transpose(1, 0, 2)  # Index as [x, y]
+              for a in (arr, flip_x, flip_y, flip_xy)]
+    return np.stack(blocks, axis=2).reshape(-1, 3)
 
 
-def detect_bg_color(pixels, w, h, sample_size=20):
+def detect_bg_color(arr, sample_size=20):
     """Detect background color from image corners."""
-    from collections import Counter
-    corner_colors = []
-    for x in range(sample_size):
-        for y in range(sample_size):
-            corner_colors.append(pixels[x, y][:3])
-            corner_colors.append(pixels[w - 1 - x, y][:3])
-            corner_colors.append(pixels[x, h - 1 - y][:3])
-            corner_colors.append(pixels[w - 1 - x, h - 1 - y][:3])
-    return Counter(corner_colors).most_common(1)[0][0]
+    corners = corner_samples(arr, sample_size)
+
+    return most_common_color(corners)
 
 
 def make_transparent(input_path, output_path=None, tolerance=10, fringe_tolerance=50):
@@ -54,107 +53,83 @@ def make_transparent(input_path, output_path=None, tolerance=10, fringe_toleranc
     Returns:
         PIL Image with transparent background
     """
-    img = Image.open(input_path).convert('RGBA')
-    pixels = img.load()
-    w, h = img.size
+    img = open_rgba(input_path)
+    arr = np.array(img)  # The one copy: read below, then cleared in place
 
     # Detect background color
-    bg_color = detect_bg_color(pixels, w, h)
+    bg_color = detect_bg_color(arr)
     print(f"Detected background: RGB{bg_color}")
 
-    def is_bg(pixel):
-        return color_dist(pixel[:3], bg_color) < tolerance
-
-    def is_fringe(pixel):
-        return color_dist(pixel[:3], bg_color) < fringe_tolerance and not is_dark(pixel)
+    # Whole-image predicates, computed once: squared distance to the
+    # background color and dark pixels (part of the outline)
+    rgb = arr[..., :3].astype(np.int32)
+    diff = rgb - np.array(bg_color, dtype=np.int32)
+    dist_sq = np.einsum('hwc,hwc->hw', diff, diff)
+    dark = (rgb < 50).all(axis=-1)
+    fillable = (dist_sq < tolerance * tolerance) & ~dark
+    fringe_ok = (dist_sq < fringe_tolerance * fringe_tolerance) & ~dark
 
     # Step 1: Flood fill from edges, stopping at dark pixels
-    visited = set()
-    to_remove = set()
-    queue = deque()
-
-    for x in range(w):
-        queue.append((x, 0))
-        queue.append((x, h - 1))
-    for y in range(h):
-        queue.append((0, y))
-        queue.append((w - 1, y))
-
-    while queue:
-        x, y = queue.popleft()
-
-        if (x, y) in visited:
-            continue
-        if x < 0 or x >= w or y < 0 or y >= h:
-            continue
-
-        pixel = pixels[x, y]
-
-        if is_dark(pixel):
-            continue
-        if not is_bg(pixel):
-            continue
-
-        visited.add((x, y))
-        to_remove.add((x, y))
-        queue.extend([(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)])
+    to_remove = flood_from_edges(fillable)
 
-    print(f"Flood fill: {len(to_remove)} pixels")
+    print(f"Flood fill: {int(to_remove.sum())} pixels")
 
     # Step 2: Fringe cleanup - remove bg-ish pixels adjacent to removed
     for pass_num in range(2):
-        fringe = set()
-        for (x, y) in to_remove:
-            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < w and 0 <= ny < h:
-                    if (nx, ny) not in to_remove:
-                        pixel = pixels[nx, ny]
-                        if is_fringe(pixel):
-                            fringe.add((nx, ny))
-
-        if not fringe:
+        fringe = grow_mask(to_remove) & fringe_ok & ~to_remove  # 4-connected
+
+        if not fringe.any():
             break
 
-        to_remove.update(fringe)
-        print(f"Fringe pass {pass_num + 1}: {len(fringe)} pixels")
+        to_remove |= fringe
+        print(f"Fringe pass {pass_num + 1}: {int(fringe.sum())} pixels")
 
     # Apply removal
-    for (x, y) in to_remove:
-        pixels[x, y] = (0, 0, 0, 0)
+    arr[to_remove] = (0, 0, 0, 0)
+    img = Image.fromarray(arr)
 
     # Save result
     if output_path is None:
         output_path = f"{Path(input_path).stem}_transparent.png"
 
     img.save(output_path, 'PNG')
-    print(f"✓ Removed {len(to_remove)} pixels total")
+    print(f"✓ Removed {int(to_remove.sum())} pixels total")
     print(f"✓ Saved: {output_path}")
 
     return img
 
 
-def apply_background(character_path, background_path, output_path=None, resample='nearest'):
+def apply_background(character, background, output_path=None, resample='nearest'):
     """
     Apply a new background to a character image.
 
     Args:
-        character_path: Path to character image (should be transparent)
-        background_path: Path to background image
+        character: Character image (should be transparent), as a path or PIL Image
+        background: Background image, as a path or PIL Image
         output_path: Where to save result
         resample: 'nearest' for pixel art, 'lanczos' for smooth scaling
     """
-    char_img = Image.open(character_path).convert('RGBA')
-    bg_img = Image.open(background_path).convert('RGBA')
+    if isinstance(character, Image.Image):
+        char_img = character if character.mode == 'RGBA' else character.convert('RGBA')
+    else:
+        char_img = open_rgba(character)
+    if isinstance(background, Image.Image):
+        bg_img = background if background.mode == 'RGBA' else background.convert('RGBA')
+    else:
+        bg_img = decode_background(background)
 
     resample_method = Image.Resampling.NEAREST if resample == 'nearest' else Image.Resampling.LANCZOS
-    char_scaled = char_img.resize(bg_img.size, resample_method)
+    if char_img.size != bg_img.size:
+        char_scaled = char_img.resize(bg_img.size, resample_method)
+    else:
+        char_scaled = char_img
 
     result = bg_img.copy()
     result.paste(char_scaled, (0, 0), char_scaled)
 
     if output_path is None:
-        output_path = f"{Path(character_path).stem}_on_bg.png"
+        stem = 'character' if isinstance(character, Image.Image) else Path(character).stem
+        output_path = f"{stem}_on_bg.png"
 
     result.save(output_path, 'PNG')
     print(f"✓ Saved: {output_path}")
@@ -162,6 +137,15 @@ def apply_background(character_path, background_path, output_path=None, resample
     return result
 
 
+def _process_one(task):
+    """Worker for batch_process; returns (file name, output, error message or None)."""
+    img_file, background_path, output_file, tolerance = task
+    output, error = run_captured(
+        lambda: apply_background(make_transparent(img_file, tolerance=tolerance),
+                                 background_path, output_file))
+    return Path(img_file).name, output, error
+
+
 def batch_process(input_dir, background_path, output_dir=None, tolerance=10):
     """
     Process all images in a directory.
@@ -178,23 +162,25 @@ def batch_process(input_dir, background_path, output_dir=None, tolerance=10):
 
     image_extensions = {'.png', '.jpg', '.jpeg', '.webp'}
 
-    processed = 0
+    tasks = []
     for img_file in sorted(input_path.iterdir()):
         if img_file.suffix.lower() not in image_extensions:
             continue
+        output_file = output_path / f"{img_file.stem}.png"
+        tasks.append((str(img_file), background_path, str(output_file), tolerance))
 
-        try:
-            # Make transparent
-            temp_img = make_transparent(str(img_file), tolerance=tolerance)
-            temp_path = f"/tmp/{img_file.stem}_temp.png"
-            temp_img.save(temp_path, 'PNG')
-
-            # Apply background
-            output_file = output_path / f"{img_file.stem}.png"
-            apply_background(temp_path, background_path, str(output_file))
-            processed += 1
-        except Exception as e:
-            print(f"✗ Error processing {img_file.name}: {e}")
+    # Images are independent, so process them in parallel, one worker per core.
+    # Tasks go out one at a time: each takes far longer than its IPC round trip.
+    processed = 0
+    with ProcessPoolExecutor() as executor:
+        for name, output, error in executor.map(_process_one, tasks):
+            if error is None:
+                print(f"{name}:")  # Header for the worker's lines; the error line names the file itself
+                print(output, end='')
+                processed += 1
+            else:
+                print(output, end='')
+                print(f"✗ Error processing {name}: {error}")
 
     print(f"\nProcessed {processed} images → {output_path}")
 
@@ -272,13 +258,11 @@ Examples:
         if bg_file:
             # Make transparent then apply background
             temp_img = make_transparent(input_file, tolerance=tolerance, fringe_tolerance=fringe_tolerance)
-            temp_path = '/tmp/temp_transparent.png'
-            temp_img.save(temp_path, 'PNG')
 
             if output_file is None:
                 output_file = f"{Path(input_file).stem}_on_bg.png"
 
-            apply_background(temp_path, bg_file, output_file, resample)
+            apply_background(temp_img, bg_file, output_file, resample)
         else:
             # Just make transparent
             make_transparent(input_file, output_file, tolerance, fringe_tolerance)